@@ -1,4 +1,7 @@
 import json
+import threading
+from functools import lru_cache
+import numpy as np
 from backend.model import SolarPredictionModel
 from backend.data_processor import SolarDataProcessor
 import traceback
@@ -10,6 +13,10 @@ processor = SolarDataProcessor()
 if model.is_trained:
     processor.feature_columns = getattr(model, 'feature_columns', [])
 
+# Training swaps the model and processor feature columns; threaded servers must not
+# run a forecast against a half-updated pair
+_model_lock = threading.Lock()
+
 def handler(environ, start_response):
     path = environ.get('PATH_INFO', '')
     method = environ.get('REQUEST_METHOD', 'GET')
@@ -45,13 +52,23 @@ def handle_train(start_response, data):
     if not data or 'solar_data' not in data:
         return response_json(start_response, {'success': False, 'error': 'Missing solar_data'}, status='400 Bad Request')
     
-    X, y, feature_cols = processor.prepare_training_data(
-        solar_data=data['solar_data'],
-        weather_data=data.get('weather_data'),
-        include_lags=True,
-        include_rolling=True
-    )
-    metrics = model.train(X, y, feature_names=feature_cols)
+    with _model_lock:
+        # prepare_training_data replaces the processor's columns; a failed train must
+        # leave them matching the model that keeps serving predictions
+        previous_columns = processor.feature_columns
+        try:
+            X, y, feature_cols = processor.prepare_training_data(
+                solar_data=data['solar_data'],
+                weather_data=data.get('weather_data'),
+                include_lags=True,
+                include_rolling=True
+            )
+            metrics = model.train(X, y, feature_names=feature_cols)
+        except Exception:
+            processor.feature_columns = previous_columns
+            raise
+        # Cached forecasts belong to the previous model
+        _cached_predict.cache_clear()
     return response_json(start_response, {
         'success': True, 
         'metrics': metrics, 
@@ -65,31 +82,47 @@ def handle_predict(start_response, data):
     if not model.is_trained:
         return response_json(start_response, {'success': False, 'error': 'Model not trained'}, status='400 Bad Request')
     
-    X = processor.prepare_prediction_data(
-        hours=data['hours'],
-        weather_data=data.get('weather_data'),
-        last_known_values=data.get('last_known_values'),
-        start_timestamp=data.get('start_timestamp')
-    )
-    predictions, lower, upper = model.predict_with_confidence(X)
+    # Identical payloads against the same model give identical forecasts
+    payload_key = json.dumps(data, sort_keys=True)
+    return response_json(start_response, _cached_predict(payload_key))
+
+@lru_cache(maxsize=1024)
+def _cached_predict(payload_key):
+    data = json.loads(payload_key)
+    with _model_lock:
+        X = processor.prepare_prediction_data(
+            hours=data['hours'],
+            weather_data=data.get('weather_data'),
+            last_known_values=data.get('last_known_values'),
+            start_timestamp=data.get('start_timestamp')
+        )
+        predictions, lower, upper = model.predict_with_confidence(X)
     
-    results = []
-    for i, hour in enumerate(data['hours']):
-        results.append({
-            'hour': hour,
-            'predicted_power': float(predictions[i]),
-            'lower_bound': float(lower[i]),
-            'upper_bound': float(upper[i])
-        })
+    # tolist() converts each array to Python floats in one call
+    results = [
+        {'hour': hour, 'predicted_power': power, 'lower_bound': low, 'upper_bound': high}
+        for hour, power, low, high in zip(data['hours'], predictions.tolist(), lower.tolist(), upper.tolist())
+    ]
         
-    return response_json(start_response, {
+    return {
         'success': True,
         'predictions': results,
         'model_metrics': model.training_metrics
-    })
+    }
+
+def _json_default(obj):
+    """Let handlers return NumPy arrays and scalars without casting them first"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+# Compact, reusable encoder; the C encoder still handles everything but NumPy values
+_json_encoder = json.JSONEncoder(separators=(',', ':'), default=_json_default)
 
 def response_json(start_response, data, status='200 OK'):
-    body = json.dumps(data).encode('utf-8')
+    body = _json_encoder.encode(data).encode('utf-8')
     headers = [
         ('Content-Type', 'application/json'),
         ('Content-Length', str(len(body))),
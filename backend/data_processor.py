@@ -1,22 +1,59 @@
 """
 Data preprocessing utilities for solar prediction model (NumPy-only version)
 """
+import json
 import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional
 
 
+class _FeatureBuilder:
+    """
+    Column store threaded through the feature pipeline. Each transform adds its
+    columns to `cols` in place and the feature matrix is assembled once at the end
+    """
+    
+    def __init__(self, datetimes: List[datetime], values: np.ndarray):
+        self.datetimes = datetimes
+        self.hours = np.array([dt.hour for dt in datetimes], dtype=int)
+        self.cols: Dict[str, np.ndarray] = {'value': values}
+        
+    def __len__(self) -> int:
+        return len(self.datetimes)
+    
+    def to_matrix(self, columns: List[str], dtype=np.float32) -> np.ndarray:
+        """
+        Stack the requested columns into X; missing columns and NaNs become 0.0
+        """
+        X = np.zeros((len(self), len(columns)), dtype=dtype)
+        for j, col in enumerate(columns):
+            if col in self.cols:
+                X[:, j] = self.cols[col]
+        X[np.isnan(X)] = 0.0
+        return X
+
+
 class SolarDataProcessor:
     """Handles data preprocessing and feature engineering for solar prediction using NumPy"""
     
+    # Accepted non-ISO timestamp formats
+    TIMESTAMP_FORMATS = ('%d.%m.%Y %H:%M', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M')
+    
+    # Number of hour-grid/weather combinations kept by prepare_prediction_data
+    TEMPLATE_CACHE_SIZE = 128
+    
     def __init__(self):
         self.feature_columns = []
+        self._template_cache = {}
         
-    def parse_csv_data(self, data: List[Dict]) -> List[Dict]:
+    def parse_csv_data(self, data: List[Dict]) -> _FeatureBuilder:
         """
-        Parse raw data from frontend into a list of dictionaries with datetime objects
+        Parse raw data from frontend into feature columns keyed by datetime
         """
         parsed = []
+        # The formats are mutually exclusive, so the one that matched last is tried
+        # first; a file normally uses a single format throughout
+        formats = list(self.TIMESTAMP_FORMATS)
         for item in data:
             row = {'timestamp': item.get('timestamp'), 'value': float(item.get('value', 0))}
             if 'extras' in item and isinstance(item['extras'], dict):
@@ -34,9 +71,12 @@ class SolarDataProcessor:
                     if 'T' in ts:
                         dt = datetime.fromisoformat(ts.replace('Z', ''))
                     else:
-                        for fmt in ('%d.%m.%Y %H:%M', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M'):
+                        for fmt in formats:
                             try:
                                 dt = datetime.strptime(ts, fmt)
+                                if fmt != formats[0]:
+                                    formats.remove(fmt)
+                                    formats.insert(0, fmt)
                                 break
                             except:
                                 continue
@@ -47,74 +87,93 @@ class SolarDataProcessor:
                 row['datetime'] = dt
                 parsed.append(row)
                 
-        return parsed
+        builder = _FeatureBuilder([row['datetime'] for row in parsed],
+                                  np.array([row['value'] for row in parsed], dtype=float))
+        # Extras become feature columns; rows without a given extra read 0.0
+        extra_keys = set()
+        for row in parsed:
+            extra_keys.update(row.keys())
+        for key in extra_keys - {'timestamp', 'datetime', 'value'}:
+            builder.cols[key] = np.array([row.get(key, 0.0) for row in parsed], dtype=float)
+        return builder
     
-    def extract_time_features(self, data: List[Dict]) -> List[Dict]:
+    def extract_time_features(self, data: _FeatureBuilder) -> _FeatureBuilder:
         """
         Extract time-based features
         """
-        for row in data:
-            dt = row['datetime']
-            row['hour'] = dt.hour
-            row['day_of_year'] = dt.timetuple().tm_yday
-            row['month'] = dt.month
-            row['season'] = (row['month'] % 12 // 3)
-            
-            # Cyclical encoding
-            row['hour_sin'] = np.sin(2 * np.pi * row['hour'] / 24)
-            row['hour_cos'] = np.cos(2 * np.pi * row['hour'] / 24)
-            row['day_sin'] = np.sin(2 * np.pi * row['day_of_year'] / 365.25)
-            row['day_cos'] = np.cos(2 * np.pi * row['day_of_year'] / 365.25)
+        hour = data.hours.astype(float)
+        day_of_year = np.array([dt.timetuple().tm_yday for dt in data.datetimes], dtype=float)
+        month = np.array([dt.month for dt in data.datetimes], dtype=float)
+        data.cols['hour'] = hour
+        data.cols['day_of_year'] = day_of_year
+        data.cols['month'] = month
+        data.cols['season'] = month % 12 // 3
+        
+        # Cyclical encoding
+        data.cols['hour_sin'] = np.sin(2 * np.pi * hour / 24)
+        data.cols['hour_cos'] = np.cos(2 * np.pi * hour / 24)
+        data.cols['day_sin'] = np.sin(2 * np.pi * day_of_year / 365.25)
+        data.cols['day_cos'] = np.cos(2 * np.pi * day_of_year / 365.25)
             
         return data
     
-    def add_weather_features(self, data: List[Dict], weather_data: Optional[List[Dict]] = None) -> List[Dict]:
+    def add_weather_features(self, data: _FeatureBuilder, weather_data: Optional[List[Dict]] = None) -> _FeatureBuilder:
         """
         Add weather-related features
         """
-        weather_map = {}
+        # Temperature per hour of day, gathered onto the rows by fancy indexing
+        temperature_by_hour = np.full(24, np.nan)
         if weather_data:
-            parsed_weather = self.parse_csv_data(weather_data)
-            for w in parsed_weather:
-                weather_map[w['datetime'].hour] = w['value']
+            weather = self.parse_csv_data(weather_data)
+            # Reversed so the last reading for a repeated hour wins, as np.unique keeps the first
+            hours, first = np.unique(weather.hours[::-1], return_index=True)
+            temperature_by_hour[hours] = weather.cols['value'][::-1][first]
         
-        for row in data:
-            h = row['datetime'].hour
-            if h in weather_map:
-                row['temperature'] = weather_map[h]
-            else:
-                # Synthetic temperature fallback
-                row['temperature'] = 26 + 16 * np.sin(2 * np.pi * (h - 6) / 24)
+        # Synthetic temperature fallback
+        missing = np.isnan(temperature_by_hour)
+        temperature_by_hour[missing] = 26 + 16 * np.sin(2 * np.pi * (np.arange(24)[missing] - 6) / 24)
+        data.cols['temperature'] = temperature_by_hour[data.hours]
                 
         return data
     
-    def add_lag_features(self, data: List[Dict], lags: List[int] = [1, 2, 3, 24]) -> List[Dict]:
+    def add_lag_features(self, data: _FeatureBuilder, lags: List[int] = [1, 2, 3, 24]) -> _FeatureBuilder:
         """
         Add lagged values (previous hours' output)
         """
-        values = [row['value'] for row in data]
-        for lag in lags:
-            col_name = f'value_lag_{lag}'
-            for i in range(len(data)):
-                if i >= lag:
-                    data[i][col_name] = values[i - lag]
-                else:
-                    data[i][col_name] = np.nan # Will be dropped later
+        values = data.cols['value']
+        n = len(values)
+        # One slab for all lags; each column is a view into it
+        lagged = np.full((n, len(lags)), np.nan, dtype=np.float32)  # Head NaNs are zero-filled in to_matrix
+        for k, lag in enumerate(lags):
+            if lag < n:
+                lagged[lag:, k] = values[:n - lag]
+        for k, lag in enumerate(lags):
+            data.cols[f'value_lag_{lag}'] = lagged[:, k]
         return data
     
-    def add_rolling_features(self, data: List[Dict], windows: List[int] = [3, 6, 12]) -> List[Dict]:
+    def add_rolling_features(self, data: _FeatureBuilder, windows: List[int] = [3, 6, 12]) -> _FeatureBuilder:
         """
         Add rolling statistics
         """
-        values = [row['value'] for row in data]
+        values = data.cols['value']
+        n = len(values)
         for window in windows:
-            mean_col = f'value_rolling_mean_{window}'
-            std_col = f'value_rolling_std_{window}'
-            for i in range(len(data)):
-                start = max(0, i - window + 1)
-                subset = values[start:i+1]
-                data[i][mean_col] = np.mean(subset)
-                data[i][std_col] = np.std(subset) if len(subset) > 1 else 0.0
+            means = np.zeros(n)
+            stds = np.zeros(n)
+            
+            # Full windows as one strided view; only the short leading windows are looped
+            head = min(window - 1, n)
+            if n >= window:
+                windowed = np.lib.stride_tricks.sliding_window_view(values, window)
+                means[head:] = windowed.mean(axis=1)
+                stds[head:] = windowed.std(axis=1)
+            for i in range(head):
+                subset = values[:i + 1]
+                means[i] = subset.mean()
+                stds[i] = subset.std() if len(subset) > 1 else 0.0
+                
+            data.cols[f'value_rolling_mean_{window}'] = means
+            data.cols[f'value_rolling_std_{window}'] = stds
         return data
     
     def prepare_training_data(
@@ -128,6 +187,8 @@ class SolarDataProcessor:
         Complete pipeline for training data. Returns (X, y, feature_cols)
         """
         data = self.parse_csv_data(solar_data)
+        if len(data) == 0:
+            raise ValueError('solar_data has no rows with a parseable timestamp')
         data = self.extract_time_features(data)
         data = self.add_weather_features(data, weather_data)
         
@@ -137,27 +198,11 @@ class SolarDataProcessor:
             data = self.add_rolling_features(data)
             
         # Define feature columns
-        exclude = {'value', 'datetime', 'timestamp'}
-        all_keys = set()
-        for row in data:
-            all_keys.update(row.keys())
-        self.feature_columns = sorted([k for k in all_keys if k not in exclude])
+        self.feature_columns = sorted(k for k in data.cols if k != 'value')
         
-        # Build X and y, filling NaN (from lags) with 0.0 instead of dropping rows
-        X_list = []
-        y_list = []
-        for row in data:
-            features = []
-            for col in self.feature_columns:
-                val = row.get(col, 0.0)
-                if isinstance(val, float) and np.isnan(val):
-                    val = 0.0  # Fill NaNs with 0.0 to prevent dropping data
-                features.append(float(val))
-            
-            X_list.append(features)
-            y_list.append(row['value'])
-                
-        return np.array(X_list), np.array(y_list), self.feature_columns
+        # NaNs (from lags) are filled with 0.0 instead of dropping rows
+        X = data.to_matrix(self.feature_columns)
+        return X, data.cols['value'], self.feature_columns
     
     def prepare_prediction_data(
         self,
@@ -169,6 +214,12 @@ class SolarDataProcessor:
         """
         Prepare data for prediction
         """
+        # Checked up front: the datetime64 arithmetic below would silently roll
+        # out-of-range hours into neighbouring days, and 1.0 would hit the cache entry for 1
+        for h in hours:
+            if not isinstance(h, (int, np.integer)) or not 0 <= h <= 23:
+                raise ValueError(f"hours must be integers in 0-23, got {h!r}")
+        
         base_date = datetime(2024, 1, 1)
         if start_timestamp:
             try:
@@ -177,36 +228,57 @@ class SolarDataProcessor:
             except:
                 pass
         
-        data = []
-        current_date = base_date
-        for i, h in enumerate(hours):
-            if i > 0 and h <= hours[i-1]:
-                current_date += timedelta(days=1)
-            dt = current_date.replace(hour=h, minute=0, second=0, microsecond=0)
-            data.append({'datetime': dt, 'hour': h, 'value': 0.0})
-            
-        data = self.extract_time_features(data)
-        data = self.add_weather_features(data, weather_data)
+        # Time and weather features only depend on the hour grid, so they are built
+        # once per grid and only the lag/rolling columns are filled per request
+        weather_key = json.dumps(weather_data, sort_keys=True) if weather_data else None
+        cache_key = (tuple(hours), base_date, weather_key, tuple(self.feature_columns))
+        template = self._template_cache.get(cache_key)
+        if template is None:
+            template = self._build_prediction_template(hours, base_date, weather_data)
+            if len(self._template_cache) >= self.TEMPLATE_CACHE_SIZE:
+                self._template_cache.pop(next(iter(self._template_cache)))
+            self._template_cache[cache_key] = template
+        
+        X = template.copy()
+        col_idx = {col: i for i, col in enumerate(self.feature_columns)}
         
         # Handle Lags
         lags = [1, 2, 3, 24]
         for lag_idx, lag in enumerate(lags):
             val = last_known_values[lag_idx] if last_known_values and lag_idx < len(last_known_values) else 0.0
-            for row in data:
-                row[f'value_lag_{lag}'] = val
+            if f'value_lag_{lag}' in col_idx:
+                X[:, col_idx[f'value_lag_{lag}']] = val
                 
         # Rolling stats proxy
         last_mean = np.mean(last_known_values) if last_known_values else 0.0
         last_std = np.std(last_known_values) if last_known_values else 0.0
         for window in [3, 6, 12]:
-            for row in data:
-                row[f'value_rolling_mean_{window}'] = last_mean
-                row[f'value_rolling_std_{window}'] = last_std
-                
-        # Build X array
-        X_list = []
-        for row in data:
-            features = [float(row.get(col, 0.0)) for col in self.feature_columns]
-            X_list.append(features)
+            if f'value_rolling_mean_{window}' in col_idx:
+                X[:, col_idx[f'value_rolling_mean_{window}']] = last_mean
+            if f'value_rolling_std_{window}' in col_idx:
+                X[:, col_idx[f'value_rolling_std_{window}']] = last_std
             
-        return np.array(X_list)
+        return X
+    
+    def _build_prediction_template(
+        self,
+        hours: List[int],
+        base_date: datetime,
+        weather_data: Optional[List[Dict]] = None
+    ) -> np.ndarray:
+        """
+        Build the prediction matrix with time/weather features and zeroed lag/rolling columns
+        """
+        # Every wrap-around in the hour sequence moves on to the next day
+        hrs = np.asarray(hours, dtype=np.int64)
+        day_bumps = np.concatenate(([0], np.cumsum(hrs[1:] <= hrs[:-1])))
+        datetimes = (np.datetime64(base_date.date(), 'D')
+                     + day_bumps.astype('timedelta64[D]')
+                     + hrs.astype('timedelta64[h]'))
+        data = _FeatureBuilder(datetimes.tolist(), np.zeros(len(hrs)))
+            
+        data = self.extract_time_features(data)
+        data = self.add_weather_features(data, weather_data)
+        
+        # Full precision here; the model casts to the dtype it was trained on
+        return data.to_matrix(self.feature_columns, dtype=np.float64)
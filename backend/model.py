@@ -45,26 +45,33 @@ class NumpyDecisionTree:
         self.min_samples_split = min_samples_split
         self.tree = None
 
-    def fit(self, X, y, depth=0):
+    def fit(self, X, y, depth=0, thresholds=None):
+        """
+        Grow the tree. With thresholds, X holds the bin codes produced by
+        NumpyRandomForest._bin_codes and splits are stored as real-valued thresholds.
+        """
         n_samples, n_features = X.shape
         if n_samples >= self.min_samples_split and depth < self.max_depth and np.var(y) > 0:
-            best_split = self._best_split(X, y, n_features)
+            best_split = self._best_split(X, y, n_features, thresholds)
             if best_split["var_red"] > 0:
-                left_subtree = self.fit(best_split["X_left"], best_split["y_left"], depth + 1)
-                right_subtree = self.fit(best_split["X_right"], best_split["y_right"], depth + 1)
+                left_subtree = self.fit(best_split["X_left"], best_split["y_left"], depth + 1, thresholds)
+                right_subtree = self.fit(best_split["X_right"], best_split["y_right"], depth + 1, thresholds)
                 return {"feature_idx": best_split["feature_idx"], "threshold": best_split["threshold"],
                         "left": left_subtree, "right": right_subtree, "value": None}
         
         leaf_value = np.mean(y) if len(y) > 0 else 0
         return {"value": leaf_value}
 
-    def _best_split(self, X, y, n_features):
+    def _best_split(self, X, y, n_features, thresholds=None):
         best_split = {"var_red": -1}
         max_var_red = -float("inf")
         
         # Only check a subset of features for faster training
         feature_indices = np.random.choice(n_features, max(1, int(np.sqrt(n_features))), replace=False)
         
+        if thresholds is not None:
+            return self._best_split_hist(X, y, feature_indices, thresholds)
+        
         for feature_idx in feature_indices:
             feature_values = X[:, feature_idx]
             possible_thresholds = np.unique(feature_values)
@@ -87,6 +94,52 @@ class NumpyDecisionTree:
                         max_var_red = var_red
         return best_split
 
+    def _best_split_hist(self, X, y, feature_indices, thresholds):
+        """
+        Histogram split search over pre-binned codes: score every candidate
+        threshold of a feature from cumulative bin sums at once
+        """
+        n = len(y)
+        parent_var = np.var(y)
+        y_sq = y * y
+        y_sum, y_sq_sum = y.sum(), y_sq.sum()
+        best_feature, best_bin, max_var_red = None, None, -float("inf")
+        
+        for feature_idx in feature_indices:
+            edges = thresholds[feature_idx]
+            if len(edges) == 0:
+                continue
+            bins = X[:, feature_idx]
+            n_left = np.cumsum(np.bincount(bins, minlength=len(edges) + 1))[:-1]
+            sum_left = np.cumsum(np.bincount(bins, weights=y, minlength=len(edges) + 1))[:-1]
+            sq_left = np.cumsum(np.bincount(bins, weights=y_sq, minlength=len(edges) + 1))[:-1]
+            n_right = n - n_left
+            valid = (n_left > 0) & (n_right > 0)
+            if not valid.any():
+                continue
+            
+            with np.errstate(divide='ignore', invalid='ignore'):
+                var_left = sq_left / n_left - (sum_left / n_left) ** 2
+                sum_right = y_sum - sum_left
+                sq_right = y_sq_sum - sq_left
+                var_right = sq_right / n_right - (sum_right / n_right) ** 2
+                var_red = parent_var - (n_left / n * var_left + n_right / n * var_right)
+            var_red = np.where(valid, var_red, -float("inf"))
+            
+            k = int(np.argmax(var_red))
+            if var_red[k] > max_var_red:
+                best_feature, best_bin, max_var_red = feature_idx, k, var_red[k]
+        
+        if best_feature is None:
+            return {"var_red": -1}
+        left = X[:, best_feature] <= best_bin
+        return {
+            "feature_idx": best_feature, "threshold": thresholds[best_feature][best_bin],
+            "X_left": X[left], "y_left": y[left],
+            "X_right": X[~left], "y_right": y[~left],
+            "var_red": max_var_red
+        }
+
     def _variance_reduction(self, parent, l_child, r_child):
         weight_l = len(l_child) / len(parent)
         weight_r = len(r_child) / len(parent)
@@ -95,6 +148,16 @@ class NumpyDecisionTree:
     def predict(self, X):
         return np.array([self._predict_single(x, self.tree) for x in X])
 
+    def predict_row(self, x):
+        """Walk the tree for a single feature vector without building arrays"""
+        node = self.tree
+        while node["value"] is None:
+            if x[node["feature_idx"]] <= node["threshold"]:
+                node = node["left"]
+            else:
+                node = node["right"]
+        return node["value"]
+
     def _predict_single(self, x, getattr_tree):
         if getattr_tree["value"] is not None:
             return getattr_tree["value"]
@@ -107,35 +170,171 @@ class NumpyDecisionTree:
 
 class NumpyRandomForest:
     """A minimal random forest regression implementation using pure NumPy"""
-    def __init__(self, n_estimators=10, max_depth=6, min_samples_split=2):
+    def __init__(self, n_estimators=10, max_depth=6, min_samples_split=2, max_bins=None,
+                 early_stopping_rounds=None):
         self.n_estimators = n_estimators
         self.max_depth = max_depth
         self.min_samples_split = min_samples_split
+        self.max_bins = max_bins
+        self.early_stopping_rounds = early_stopping_rounds
         self.trees = []
+        self.input_dtype = np.float64
+        self._compiled = None
         
     def fit(self, X, y):
-        self.trees = []
+        """
+        Fit the forest. With max_bins, split candidates are binned once per feature
+        instead of per node; with early_stopping_rounds, no more trees are added once
+        the out-of-bag RMSE stops improving. Out-of-bag rows are the training rows each
+        tree's bootstrap left out, so no validation data is spent on the stop.
+        """
+        # Split thresholds are exact values of this dtype, so inputs must match it
+        self.input_dtype = X.dtype
+        
+        # Quantize once per fit; the trees then split on compact bin codes
+        if self.max_bins:
+            thresholds = self._bin_thresholds(X)
+            X_fit = self._bin_codes(X, thresholds)
+        else:
+            thresholds, X_fit = None, X
+        
+        early_stopping = bool(self.early_stopping_rounds) and len(y) > 0
+        if early_stopping:
+            oob_sum = np.zeros(len(y))
+            oob_count = np.zeros(len(y))
+            best_rmse, rounds_since_best = float("inf"), 0
+        
+        # Build into a local list so concurrent predictions never see a partial forest
+        trees = []
         for _ in range(self.n_estimators):
             tree = NumpyDecisionTree(self.max_depth, self.min_samples_split)
             indices = np.random.choice(len(X), len(X), replace=True)
-            X_sample, y_sample = X[indices], y[indices]
-            tree.tree = tree.fit(X_sample, y_sample)
-            self.trees.append(tree)
+            X_sample, y_sample = X_fit[indices], y[indices]
+            tree.tree = tree.fit(X_sample, y_sample, thresholds=thresholds)
+            trees.append(tree)
+            
+            if early_stopping:
+                oob = np.ones(len(y), dtype=bool)
+                oob[indices] = False
+                if not oob.any():
+                    continue
+                oob_sum[oob] += self._traverse(self._compile([tree]), X[oob])
+                oob_count[oob] += 1
+                scored = oob_count > 0
+                rmse = calculate_metrics(y[scored], oob_sum[scored] / oob_count[scored])['rmse']
+                if rmse < best_rmse:
+                    best_rmse, rounds_since_best = rmse, 0
+                else:
+                    rounds_since_best += 1
+                    # Averaging in more trees does not overfit, so the built ones are kept
+                    if rounds_since_best >= self.early_stopping_rounds:
+                        break
+        
+        # Set the compiled arrays first; predict() only reads _compiled
+        self._compiled = self._compile(trees)
+        self.trees = trees
+    
+    def _bin_thresholds(self, X):
+        """Candidate split thresholds per feature: all unique values, or max_bins quantiles"""
+        thresholds = []
+        for feature_idx in range(X.shape[1]):
+            feature_values = X[:, feature_idx]
+            candidates = np.unique(feature_values)
+            if len(candidates) > self.max_bins:
+                candidates = np.unique(np.quantile(feature_values, np.linspace(0, 1, self.max_bins + 1)[1:-1]))
+            thresholds.append(candidates)
+        return thresholds
+    
+    @staticmethod
+    def _bin_codes(X, thresholds):
+        """Bin index per value: value <= thresholds[f][k] exactly when its code is <= k"""
+        fits_uint8 = all(len(edges) < 256 for edges in thresholds)
+        codes = np.empty(X.shape, dtype=np.uint8 if fits_uint8 else np.intp)
+        for feature_idx, edges in enumerate(thresholds):
+            codes[:, feature_idx] = np.searchsorted(edges, X[:, feature_idx], side='left')
+        return codes
+            
+    def __getstate__(self):
+        # The dict trees are the saved source; predict() recompiles lazily after loading
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+    
+    @staticmethod
+    def _compile(trees):
+        """
+        Flatten the dict trees into node arrays (feature, threshold, left, right, value)
+        plus each tree's root index and the deepest path. Leaves point to themselves
+        with an infinite threshold, so a fixed number of steps settles every row.
+        """
+        feature, threshold, left, right, value = [], [], [], [], []
+        
+        def add(node, depth):
+            idx = len(feature)
+            feature.append(0)
+            threshold.append(np.inf)
+            left.append(idx)
+            right.append(idx)
+            value.append(0.0)
+            if node["value"] is None:
+                feature[idx] = node["feature_idx"]
+                threshold[idx] = node["threshold"]
+                left[idx], left_depth = add(node["left"], depth + 1)
+                right[idx], right_depth = add(node["right"], depth + 1)
+                return idx, max(left_depth, right_depth)
+            value[idx] = node["value"]
+            return idx, depth
+        
+        roots, depth = [], 0
+        for tree in trees:
+            root, tree_depth = add(tree.tree, 0)
+            roots.append(root)
+            depth = max(depth, tree_depth)
+        
+        return (np.array(feature, dtype=np.intp), np.array(threshold, dtype=np.float64),
+                np.array(left, dtype=np.intp), np.array(right, dtype=np.intp),
+                np.array(value, dtype=np.float64), np.array(roots, dtype=np.intp), depth)
             
     def predict(self, X):
         if not self.trees:
             return np.zeros(len(X))
-        tree_preds = np.array([tree.predict(X) for tree in self.trees])
-        return np.mean(tree_preds, axis=0)
+        if getattr(self, '_compiled', None) is None:
+            # Forests pickled before compilation existed
+            self._compiled = self._compile(self.trees)
+        return self._traverse(self._compiled, X)
+
+    @staticmethod
+    def _traverse(compiled, X):
+        """Mean prediction of the compiled trees, walking every (tree, row) pair one level per step"""
+        feature, threshold, left, right, value, roots, depth = compiled
+        rows = np.arange(len(X))
+        nodes = np.repeat(roots[:, None], len(X), axis=1)
+        for _ in range(depth):
+            go_left = X[rows, feature[nodes]] <= threshold[nodes]
+            nodes = np.where(go_left, left[nodes], right[nodes])
+        return np.mean(value[nodes], axis=0)
+
+    def predict_row(self, x):
+        """Single-row prediction that skips the per-tree array round trip of predict()"""
+        if not self.trees:
+            return 0.0
+        return sum(tree.predict_row(x) for tree in self.trees) / len(self.trees)
 
 class SolarPredictionModel:
     """Pure NumPy Serverless-friendly solar power prediction model"""
     
     def __init__(self, model_path: str = 'models/solar_model.pkl'):
         self.model_path = model_path
-        self.model = NumpyRandomForest(n_estimators=15, max_depth=7)
+        self.params = {
+            'n_estimators': 15,
+            'max_depth': 7,
+            'max_bins': 128,
+            'early_stopping_rounds': 10
+        }
+        self.model = NumpyRandomForest(**self.params)
         self.is_trained = False
         self.feature_importance = {}
+        self._sorted_importance = []
         self.training_metrics = {}
         self.feature_columns = []
         
@@ -149,7 +348,13 @@ class SolarPredictionModel:
         test_size: float = 0.2,
         validation_split: float = 0.1
     ) -> Dict[str, float]:
+        # Fail before touching any state so the trained model (and its pickle) survive
+        if len(X) == 0:
+            raise ValueError("Cannot train on an empty feature matrix")
         self.feature_columns = feature_names
+        # float32 halves the memory traffic of the split search; targets keep full precision
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float64)
         
         X_train, X_test, y_train, y_test = manual_train_test_split(
             X, y, test_size=test_size, shuffle=False
@@ -160,7 +365,10 @@ class SolarPredictionModel:
         )
         
         print("Training Pure NumPy Random Forest Engine...")
-        self.model.fit(X_train, y_train)
+        # Fit a fresh forest so a model loaded from disk picks up the current params
+        model = NumpyRandomForest(**self.params)
+        model.fit(X_train, y_train)
+        self.model = model
         
         y_train_pred = self.model.predict(X_train)
         y_val_pred = self.model.predict(X_val)
@@ -182,15 +390,18 @@ class SolarPredictionModel:
             'test_r2': test_metrics['r2']
         }
         
-        self._compute_permutation_importance(X_val, y_val)
+        self._compute_permutation_importance(X_val, y_val, y_val_pred)
         self.is_trained = True
         self._save_model()
         
         return self.training_metrics
 
-    def _compute_permutation_importance(self, X_val, y_val):
+    def _compute_permutation_importance(self, X_val, y_val, y_val_pred=None):
         """Calculate feature importances using permutation logic (pure numpy)"""
-        baseline_rmse = calculate_metrics(y_val, self.model.predict(X_val))['rmse']
+        # Reuse the validation predictions from train() instead of scoring X_val again
+        if y_val_pred is None:
+            y_val_pred = self.model.predict(X_val)
+        baseline_rmse = calculate_metrics(y_val, y_val_pred)['rmse']
         importances = []
         for i in range(X_val.shape[1]):
             X_val_perm = X_val.copy()
@@ -204,45 +415,55 @@ class SolarPredictionModel:
             importances = importances / sum_imp
             
         self.feature_importance = {name: float(imp) for name, imp in zip(self.feature_columns, importances)}
+        self._sort_importance()
+    
+    def _sort_importance(self):
+        """Rank features once per train/load so get_feature_importance only slices"""
+        self._sorted_importance = sorted(self.feature_importance.items(), key=lambda x: x[1], reverse=True)
     
     def predict(self, X: np.ndarray) -> np.ndarray:
         if not self.is_trained:
             raise ValueError("Model must be trained before making predictions")
-        predictions = self.model.predict(X)
+        predictions = self.model.predict(np.asarray(X, dtype=self._input_dtype()))
         return np.maximum(predictions, 0)
 
     def predict_recursive(self, X: np.ndarray) -> np.ndarray:
         if not self.is_trained:
             raise ValueError("Model must be trained before making predictions")
             
-        X = X.copy()
+        X = np.array(X, dtype=self._input_dtype())
+        n = len(X)
         predictions = []
         
+        # Resolve column indices once; each step then only touches the cells it feeds
         feature_names = self.feature_columns
-        lag_indices = {f'value_lag_{lag}': feature_names.index(f'value_lag_{lag}') 
+        lag_indices = {lag: feature_names.index(f'value_lag_{lag}')
                        for lag in [1, 2, 3, 24] if f'value_lag_{lag}' in feature_names}
         
-        rolling_mean_indices = {f'value_rolling_mean_{w}': feature_names.index(f'value_rolling_mean_{w}')
+        rolling_mean_indices = {w: feature_names.index(f'value_rolling_mean_{w}')
                                 for w in [3, 6, 12] if f'value_rolling_mean_{w}' in feature_names}
         
-        for i in range(len(X)):
-            current_X = X[[i]]
-            pred = self.model.predict(current_X)[0]
-            pred = max(0, pred)
+        for i in range(n):
+            pred = self.model.predict_row(X[i])
+            pred = max(0.0, pred)
             predictions.append(pred)
             
-            for j in range(i + 1, len(X)):
-                dist = j - i
-                lag_key = f'value_lag_{dist}'
-                if lag_key in lag_indices:
-                    X[j, lag_indices[lag_key]] = pred
-                    
-                for w_key, w_idx in rolling_mean_indices.items():
-                    window = int(w_key.split('_')[-1])
+            # A prediction at step i is the lag-k input of row i + k
+            for lag, col_idx in lag_indices.items():
+                if i + lag < n:
+                    X[i + lag, col_idx] = pred
+            
+            # Rolling means are only read by the next row before being refreshed again
+            if i + 1 < n:
+                for window, col_idx in rolling_mean_indices.items():
                     recent = predictions[-window:]
-                    X[j, w_idx] = np.mean(recent) if recent else 0
+                    X[i + 1, col_idx] = sum(recent) / len(recent)
                         
-        return np.array(predictions)
+        return np.asarray(predictions, dtype=float)
+
+    def _input_dtype(self):
+        """dtype the forest was fit on; forests pickled before it was recorded used float64"""
+        return getattr(self.model, 'input_dtype', np.float64)
 
     def predict_with_confidence(self, X: np.ndarray, n_iterations: int = 100) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         predictions = self.predict_recursive(X)
@@ -255,10 +476,7 @@ class SolarPredictionModel:
         return predictions, lower_bound, upper_bound
     
     def get_feature_importance(self, top_n: int = 10) -> Dict[str, float]:
-        if not self.feature_importance:
-            return {}
-        sorted_features = sorted(self.feature_importance.items(), key=lambda x: x[1], reverse=True)
-        return dict(sorted_features[:top_n])
+        return dict(self._sorted_importance[:top_n])
     
     def _save_model(self):
         try:
@@ -291,6 +509,7 @@ class SolarPredictionModel:
                 
                 self.model = model_data.get('model_obj')
                 self.feature_importance = model_data.get('feature_importance', {})
+                self._sort_importance()
                 self.training_metrics = model_data.get('training_metrics', {})
                 self.is_trained = model_data.get('is_trained', False)
                 self.feature_columns = model_data.get('feature_columns', [])
@@ -1,13 +1,9 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
 
 # Create 1 year of hourly data
-start_date = datetime(2023, 1, 1)
 hours = 24 * 365
-dates = [start_date + timedelta(hours=i) for i in range(hours)]
-
-df = pd.DataFrame({'timestamp': dates})
+df = pd.DataFrame({'timestamp': pd.date_range('2023-01-01', periods=hours, freq='h')})
 
 # Generate realistic Radiation (0-1000 W/m2)
 # Bell curve during day, 0 at night, seasonal variation
@@ -0,0 +1,15 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -k gthread --threads 8 --preload wsgi:app
+
+The model and data processor are module-level globals in api/index.py, so with
+--preload they are loaded once in the master before workers are forked.
+"""
+import gc
+
+from api.index import app
+
+# Keep the cyclic GC in forked workers from touching the preloaded model objects,
+# which would copy their pages into every worker
+gc.freeze()